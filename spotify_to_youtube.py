@@ -1,15 +1,20 @@
 import os
-import json
+import random
+import re
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import orjson
 from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process
 from tqdm import tqdm
 
 # Load environment variables
@@ -20,22 +25,120 @@ SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIPY_REDIRECT_URI')
 YOUTUBE_CLIENT_SECRET_FILE = 'client_secret.json'
 SPOTIFY_SCOPE = 'playlist-read-private'
 YOUTUBE_SCOPE = ['https://www.googleapis.com/auth/youtube.force-ssl']
-CACHE_FILE = 'video_cache.json'
+CACHE_FILE = 'video_cache.db'
+LEGACY_JSONL_CACHE_FILE = 'video_cache.jsonl'
+LEGACY_JSON_CACHE_FILE = 'video_cache.json'
+PLAYLIST_CACHE_FILE = 'playlist_cache.json'
 FAILED_TRACKS_FILE = 'failed_tracks.txt'
+INSERT_BATCH_SIZE = 50
+BATCH_SLEEP_SECONDS = 0.15
+MAX_SEARCH_WORKERS = 8  # keep small: search costs 100 quota units each
+NEGATIVE_CACHE_TTL = 7 * 24 * 3600  # re-query not-found tracks after a week
+MIN_TOKEN_OVERLAP = 0.3  # candidates sharing fewer query tokens skip fuzzy scoring
+FIRST_RESULT_ACCEPT_SCORE = 85  # trust YouTube's top-ranked result at this score
+
+# Cosmetic noise in track titles ("(feat. X)", "(Live)", "- 2011 Remaster"...)
+# causes cache misses for what is the same song. The lookahead requires a
+# word boundary after each keyword so "(Without You)" or "(Liverpool
+# Session)" aren't mistaken for noise, while "feat." still matches.
+NOISE_RE = re.compile(
+    r'\((?:feat|ft|with|live|acoustic|remaster(?:ed)?)\.?(?=[\s)])[^)]*\)'
+    r'|- *(?:\d{4} )?remaster(?:ed)?(?: version)?',
+    re.IGNORECASE
+)
+NON_WORD_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+cache_lock = threading.Lock()
+cache_db = None  # opened by load_cache
+failed_tracks_lock = threading.Lock()
+failed_tracks_file = None  # opened lazily on the first failure
+thread_local = threading.local()
+quota_exhausted = threading.Event()
+
+def normalize(title):
+    """Collapse a track string to a canonical cache key."""
+    title = NOISE_RE.sub(' ', title.lower())
+    title = NON_WORD_RE.sub(' ', title)
+    return WHITESPACE_RE.sub(' ', title).strip()
+
+def load_legacy_cache():
+    """Collect entries from the retired JSONL/JSON cache files, if any."""
+    cache = {}
+    if Path(LEGACY_JSONL_CACHE_FILE).exists():
+        with open(LEGACY_JSONL_CACHE_FILE, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except ValueError:
+                    continue  # partial line from an interrupted write
+                cache[normalize(record['title'])] = {'id': record['id'], 'ts': record['ts']}
+    elif Path(LEGACY_JSON_CACHE_FILE).exists():
+        with open(LEGACY_JSON_CACHE_FILE, 'rb') as f:
+            raw = orjson.loads(f.read())
+        for title, entry in raw.items():
+            cache[normalize(title)] = entry if isinstance(entry, dict) else {'id': entry, 'ts': int(time.time())}
+    return cache
 
 def load_cache():
-    if Path(CACHE_FILE).exists():
-        with open(CACHE_FILE, 'r') as f:
-            return json.load(f)
+    global cache_db
+    cache_db = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+    cache_db.execute('PRAGMA journal_mode=WAL')
+    cache_db.execute('PRAGMA synchronous=NORMAL')
+    cache_db.execute(
+        'CREATE TABLE IF NOT EXISTS cache(title TEXT PRIMARY KEY, video_id TEXT, found_at INTEGER)'
+    )
+    if not cache_db.execute('SELECT 1 FROM cache LIMIT 1').fetchone():
+        legacy = load_legacy_cache()
+        if legacy:
+            with cache_db:
+                cache_db.executemany(
+                    'INSERT OR REPLACE INTO cache(title, video_id, found_at) VALUES (?, ?, ?)',
+                    [(title, entry['id'], entry['ts']) for title, entry in legacy.items()]
+                )
+    return {
+        title: {'id': video_id, 'ts': found_at}
+        for title, video_id, found_at in cache_db.execute('SELECT title, video_id, found_at FROM cache')
+    }
+
+def cache_lookup(cache, title):
+    """Return (hit, video_id). A cached miss counts as a hit until its TTL expires."""
+    entry = cache.get(title)
+    if entry is None:
+        return False, None
+    video_id = entry['id']
+    if video_id is None and time.time() - entry['ts'] > NEGATIVE_CACHE_TTL:
+        return False, None  # stale negative: worth re-querying
+    return True, video_id
+
+def cache_store(cache, title, video_id):
+    entry = {'id': video_id, 'ts': int(time.time())}
+    with cache_lock:
+        cache[title] = entry
+        with cache_db:
+            cache_db.execute(
+                'INSERT OR REPLACE INTO cache(title, video_id, found_at) VALUES (?, ?, ?)',
+                (title, video_id, entry['ts'])
+            )
+
+def load_playlist_cache():
+    if Path(PLAYLIST_CACHE_FILE).exists():
+        with open(PLAYLIST_CACHE_FILE, 'rb') as f:
+            return orjson.loads(f.read())
     return {}
 
-def save_cache(cache):
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache, f, indent=2)
+def save_playlist_cache(playlist_cache):
+    with open(PLAYLIST_CACHE_FILE, 'wb') as f:
+        f.write(orjson.dumps(playlist_cache, option=orjson.OPT_INDENT_2))
 
 def log_failed_track(track, playlist_name):
-    with open(FAILED_TRACKS_FILE, 'a', encoding='utf-8') as f:
-        f.write(f'[{playlist_name}] {track}\n')
+    global failed_tracks_file
+    # Conversion threads log concurrently; the lock covers both the lazy
+    # open and the write.
+    with failed_tracks_lock:
+        if failed_tracks_file is None:
+            failed_tracks_file = open(FAILED_TRACKS_FILE, 'a', encoding='utf-8', buffering=1)
+        failed_tracks_file.write(f'[{playlist_name}] {track}\n')
 
 def authenticate_spotify():
     return spotipy.Spotify(auth_manager=SpotifyOAuth(
@@ -48,14 +151,29 @@ def authenticate_spotify():
 def authenticate_youtube():
     flow = InstalledAppFlow.from_client_secrets_file(
         YOUTUBE_CLIENT_SECRET_FILE, scopes=YOUTUBE_SCOPE)
-    credentials = flow.run_local_server(port=0)
-    return build('youtube', 'v3', credentials=credentials)
+    return flow.run_local_server(port=0)
+
+def build_youtube_client(credentials):
+    return build('youtube', 'v3', credentials=credentials, cache_discovery=False)
+
+def youtube_for_thread(credentials):
+    # httplib2.Http is not thread-safe, so each worker gets its own client.
+    if not hasattr(thread_local, 'youtube'):
+        thread_local.youtube = build_youtube_client(credentials)
+    return thread_local.youtube
 
 def get_spotify_tracks(sp, playlist_id):
-    playlist_info = sp.playlist(playlist_id)
+    # One round-trip for name and first page of tracks, trimmed to the
+    # fields actually used (the default payload includes album art,
+    # available_markets and more).
+    playlist_info = sp.playlist(
+        playlist_id,
+        fields='name,tracks.items(track(name,artists(name))),tracks.next',
+        additional_types=('track',)
+    )
     playlist_name = playlist_info['name']
     tracks = []
-    results = sp.playlist_tracks(playlist_id)
+    results = playlist_info['tracks']
     while results:
         for item in results['items']:
             track = item['track']
@@ -94,23 +212,58 @@ def create_youtube_playlist(youtube, title):
     response = request.execute()
     return response['id']
 
-def get_video_ids_in_playlist(youtube, playlist_id):
-    video_ids = set()
+def get_playlist_item_count(youtube, playlist_id):
+    request = youtube.playlists().list(
+        part='contentDetails',
+        id=playlist_id,
+        fields='items/contentDetails/itemCount'
+    )
+    response = retry(request.execute)
+    items = response.get('items', [])
+    return items[0]['contentDetails']['itemCount'] if items else 0
+
+def get_videos_in_playlist(youtube, playlist_id):
+    """Return {video_id: title} for every item in the playlist."""
+    videos = {}
     nextPageToken = None
     while True:
         request = youtube.playlistItems().list(
             part="snippet",
             playlistId=playlist_id,
             maxResults=50,
-            pageToken=nextPageToken
+            pageToken=nextPageToken,
+            fields='items/snippet(title,resourceId/videoId),nextPageToken'
         )
         response = request.execute()
-        for item in response['items']:
-            video_ids.add(item['snippet']['resourceId']['videoId'])
+        for item in response.get('items', []):
+            snippet = item['snippet']
+            videos[snippet['resourceId']['videoId']] = snippet['title']
         nextPageToken = response.get('nextPageToken')
         if not nextPageToken:
             break
-    return video_ids
+    return videos
+
+def find_existing_match(title_key, existing_title_keys):
+    """Map a normalized track to a video already in the playlist, if any."""
+    video_id = existing_title_keys.get(title_key)
+    if video_id is not None:
+        return video_id
+    key_tokens = set(title_key.split())
+    if not key_tokens:
+        return None
+    # A video whose title covers every token of the track (e.g. the same
+    # song with an "(Official Video)" suffix) is the track we'd find anyway.
+    for existing_key, video_id in existing_title_keys.items():
+        if key_tokens <= set(existing_key.split()):
+            return video_id
+    return None
+
+def error_reason(e):
+    try:
+        data = orjson.loads(e.content)
+        return data['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError):
+        return ''
 
 def retry(func, *args, **kwargs):
     max_retries = 5
@@ -118,51 +271,129 @@ def retry(func, *args, **kwargs):
         try:
             return func(*args, **kwargs)
         except HttpError as e:
-            if e.resp.status in [403, 409, 429, 500, 503]:
-                sleep_time = 2 ** attempt
-                print(f"Quota/temporary error (attempt {attempt+1}), retrying in {sleep_time}s...")
-                time.sleep(sleep_time)
-            else:
+            if e.resp.status == 403 and error_reason(e) == 'quotaExceeded':
+                # Flag the abort at the detection site so searches already
+                # queued on other threads drain without firing API calls.
+                quota_exhausted.set()
+                raise  # daily quota is exhausted; retrying can't help
+            if e.resp.status not in [403, 409, 429, 500, 503] or attempt == max_retries - 1:
                 raise
+            sleep_time = 2 ** attempt + random.uniform(0, 1)
+            retry_after = e.resp.get('retry-after')
+            if retry_after:
+                try:
+                    sleep_time = float(retry_after)
+                except ValueError:
+                    pass  # HTTP-date form; stick with exponential backoff
+            print(f"Quota/temporary error (attempt {attempt+1}), retrying in {sleep_time:.1f}s...")
+            time.sleep(sleep_time)
 
 def fuzzy_search_youtube(youtube, query, original_title, cache):
-    if original_title in cache:
-        return cache[original_title]
+    hit, video_id = cache_lookup(cache, original_title)
+    if hit:
+        return video_id
+    if quota_exhausted.is_set():
+        return None  # a doomed search would just burn the drain time
 
-    response = retry(
-        youtube.search().list,
-        q=query, part='snippet', type='video', maxResults=5
-    ).execute()
+    request = youtube.search().list(
+        q=query, part='snippet', type='video', maxResults=3,
+        fields='items(id/videoId,snippet/title)'
+    )
+    response = retry(request.execute)
 
+    original_lower = original_title.lower()
+    query_tokens = set(original_lower.split())
+    # Partial responses omit 'items' entirely when there are no results.
+    items = response.get('items', [])
     best_score = 0
     best_video_id = None
-    for item in response['items']:
-        video_title = item['snippet']['title']
-        score = fuzz.token_set_ratio(video_title.lower(), original_title.lower())
-        if score > best_score:
-            best_score = score
-            best_video_id = item['id']['videoId']
-
-    if best_video_id:
-        cache[original_title] = best_video_id
+    if items:
+        # Results are relevance-ranked; a strong top hit makes scoring
+        # the rest pointless.
+        best_score = fuzz.token_set_ratio(items[0]['snippet']['title'].lower(), original_lower)
+        best_video_id = items[0]['id']['videoId']
+    if best_score < FIRST_RESULT_ACCEPT_SCORE:
+        candidates = []  # (lowered title, video_id) surviving the prefilter
+        for item in items[1:]:
+            video_title_lower = item['snippet']['title'].lower()
+            # Cheap token-overlap check weeds out obvious non-matches before
+            # paying for the Levenshtein-based score.
+            overlap = len(query_tokens & set(video_title_lower.split()))
+            if query_tokens and overlap / len(query_tokens) < MIN_TOKEN_OVERLAP:
+                continue
+            candidates.append((video_title_lower, item['id']['videoId']))
+        if candidates:
+            # One C-level call scores every survivor and tokenizes the
+            # query once, instead of a Python-level call per candidate.
+            match = process.extractOne(
+                original_lower, [title for title, _ in candidates],
+                scorer=fuzz.token_set_ratio, processor=None
+            )
+            if match[1] > best_score:
+                best_score = match[1]
+                best_video_id = candidates[match[2]][1]
+
+    # Cache misses too, so re-runs don't re-spend quota on tracks with no match.
+    cache_store(cache, original_title, best_video_id)
     return best_video_id
 
-def add_to_youtube_playlist(youtube, playlist_id, video_id):
-    retry(
-        youtube.playlistItems().insert,
-        part="snippet",
-        body={
-            "snippet": {
-                "playlistId": playlist_id,
-                "resourceId": {
-                    "kind": "youtube#video",
-                    "videoId": video_id
-                }
+def playlist_item_body(playlist_id, video_id):
+    return {
+        "snippet": {
+            "playlistId": playlist_id,
+            "resourceId": {
+                "kind": "youtube#video",
+                "videoId": video_id
             }
         }
-    ).execute()
+    }
+
+def add_to_youtube_playlist(youtube, playlist_id, video_id):
+    retry(
+        youtube.playlistItems().insert(
+            part="snippet",
+            body=playlist_item_body(playlist_id, video_id)
+        ).execute
+    )
+
+def add_to_youtube_playlist_batch(youtube, playlist_id, items, playlist_name):
+    """Insert (video_id, track) pairs 50 at a time via batched HTTP requests."""
+    for start in range(0, len(items), INSERT_BATCH_SIZE):
+        chunk = items[start:start + INSERT_BATCH_SIZE]
+        failed = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                failed.append(chunk[int(request_id) - start])
 
-def convert_playlist(sp, youtube, spotify_playlist_id, cache):
+        batch = youtube.new_batch_http_request(callback=callback)
+        for i, (video_id, _) in enumerate(chunk, start=start):
+            batch.add(
+                youtube.playlistItems().insert(
+                    part="snippet",
+                    body=playlist_item_body(playlist_id, video_id)
+                ),
+                request_id=str(i)
+            )
+        retry(batch.execute)
+        # Retry failures one by one; anything still failing gets logged.
+        for video_id, track in failed:
+            try:
+                add_to_youtube_playlist(youtube, playlist_id, video_id)
+            except HttpError as e:
+                if error_reason(e) == 'quotaExceeded':
+                    # Not a per-track failure: the whole run is out of
+                    # quota. Abort rather than log every remaining track.
+                    quota_exhausted.set()
+                    raise
+                log_failed_track(track, playlist_name)
+                print(f"✗ Could not add: {track}")
+        time.sleep(BATCH_SLEEP_SECONDS)
+
+def search_in_thread(credentials, query, title_key, cache):
+    return fuzzy_search_youtube(youtube_for_thread(credentials), query, title_key, cache)
+
+def convert_playlist(sp, youtube, credentials, spotify_playlist_id, cache, playlist_cache):
     playlist_name, tracks = get_spotify_tracks(sp, spotify_playlist_id)
     print(f"\n🎧 Converting: {playlist_name}")
 
@@ -173,35 +404,134 @@ def convert_playlist(sp, youtube, spotify_playlist_id, cache):
         yt_playlist_id = create_youtube_playlist(youtube, playlist_name)
         print(f"Created new playlist: {playlist_name}")
 
-    existing_video_ids = get_video_ids_in_playlist(youtube, yt_playlist_id)
+    # The snapshot from the last run saves paginating the whole playlist
+    # (1 quota unit for the count check vs 1 per 50 items). Older
+    # snapshots stored a bare id list without titles; refetch those.
+    snapshot = playlist_cache.get(yt_playlist_id)
+    if (snapshot is not None and isinstance(snapshot['videos'], dict)
+            and get_playlist_item_count(youtube, yt_playlist_id) == len(snapshot['videos'])):
+        existing_videos = dict(snapshot['videos'])
+    else:
+        existing_videos = get_videos_in_playlist(youtube, yt_playlist_id)
+    existing_title_keys = {normalize(title): video_id for video_id, title in existing_videos.items()}
 
-    for track in tqdm(tracks, desc=f"Adding to {playlist_name}"):
-        video_id = fuzzy_search_youtube(youtube, track, track, cache)
-        if not video_id:
-            log_failed_track(track, playlist_name)
-            print(f"✗ Not Found: {track}")
+    # Cache keys are normalized so cosmetic variants of the same song
+    # ("Song (feat. X)" vs "Song") share one entry and one search.
+    # Cached tracks (hits and fresh misses) cost zero API calls; only the rest go through the pool.
+    keyed_tracks = [(track, normalize(track)) for track in tracks]
+    results = {}
+    to_search = {}  # normalized key -> raw title used as the search query
+    for track, key in keyed_tracks:
+        hit, video_id = cache_lookup(cache, key)
+        if hit:
+            results[key] = video_id
             continue
-        if video_id in existing_video_ids:
-            continue  # Don't add duplicates
-        add_to_youtube_playlist(youtube, yt_playlist_id, video_id)
-        existing_video_ids.add(video_id)
+        # A title already in the destination playlist settles the track
+        # without spending 100 units on a search.
+        existing_id = find_existing_match(key, existing_title_keys)
+        if existing_id is not None:
+            results[key] = existing_id
+            cache_store(cache, key, existing_id)
+        elif key not in to_search:
+            to_search[key] = track
+
+    if quota_exhausted.is_set():
+        print(f"⏭ Stopping {playlist_name} before searching: daily quota exhausted")
+        return
+
+    # Pipeline the two stages: while workers search ahead, the main
+    # thread consumes results in playlist order and flushes a full
+    # insert batch as soon as 50 tracks are matched, so inserts for
+    # early tracks overlap with searches for later ones.
+    pending = []
+    with ThreadPoolExecutor(max_workers=MAX_SEARCH_WORKERS) as executor:
+        future_by_key = {
+            key: executor.submit(search_in_thread, credentials, query, key, cache)
+            for key, query in to_search.items()
+        }
+        for track, key in tqdm(keyed_tracks, desc=f"Matching {playlist_name}"):
+            # Another playlist may have burned through the daily quota;
+            # stop before this one spends searches and inserts on it too.
+            if quota_exhausted.is_set():
+                for future in future_by_key.values():
+                    future.cancel()
+                print(f"⏭ Stopping {playlist_name}: daily quota exhausted")
+                return
+            if key in results:
+                video_id = results[key]
+            else:
+                video_id = future_by_key[key].result()
+                results[key] = video_id
+            if not video_id:
+                if quota_exhausted.is_set():
+                    # Not a real miss: the search was skipped by the abort.
+                    continue
+                log_failed_track(track, playlist_name)
+                print(f"✗ Not Found: {track}")
+                continue
+            if video_id in existing_videos:
+                continue  # Don't add duplicates
+            pending.append((video_id, track))
+            existing_videos[video_id] = track
+            if len(pending) >= INSERT_BATCH_SIZE and not quota_exhausted.is_set():
+                add_to_youtube_playlist_batch(youtube, yt_playlist_id, pending, playlist_name)
+                pending = []
+
+    if quota_exhausted.is_set():
+        # Skipped inserts are already in existing_videos; don't snapshot them.
+        return
+    if pending:
+        add_to_youtube_playlist_batch(youtube, yt_playlist_id, pending, playlist_name)
+    playlist_cache[yt_playlist_id] = {'videos': existing_videos}
+
+def convert_playlist_in_thread(sp, credentials, spotify_playlist_id, cache, playlist_cache):
+    if quota_exhausted.is_set():
+        print(f"⏭ Skipping {spotify_playlist_id}: daily quota exhausted")
+        return
+    try:
+        convert_playlist(sp, youtube_for_thread(credentials), credentials,
+                         spotify_playlist_id, cache, playlist_cache)
+    except HttpError as e:
+        if error_reason(e) == 'quotaExceeded':
+            # Don't let the remaining playlists burn their retry budgets
+            # on a quota that won't come back until tomorrow.
+            quota_exhausted.set()
+        raise
 
 if __name__ == '__main__':
     print("==== Spotify to YouTube Music Playlist Converter ====")
     print("NOTE: Make sure your credentials, '.env', and 'client_secret.json' are set up!\n")
 
     sp = authenticate_spotify()
-    youtube = authenticate_youtube()
+    credentials = authenticate_youtube()
     cache = load_cache()
+    playlist_cache = load_playlist_cache()
 
     playlist_ids = input("Enter Spotify playlist IDs (comma-separated): ").split(',')
-    playlist_ids = [p.strip() for p in playlist_ids if p.strip()]
+    # Dedupe: concurrent conversions of the same playlist would race to
+    # create it twice on YouTube.
+    playlist_ids = list(dict.fromkeys(p.strip() for p in playlist_ids if p.strip()))
 
-    for pid in playlist_ids:
-        try:
-            convert_playlist(sp, youtube, pid, cache)
-        except Exception as e:
-            print(f"❌ Error converting {pid}: {e}")
+    try:
+        # Playlists are independent, so their Spotify and YouTube I/O can
+        # overlap; each conversion thread builds its own YouTube client.
+        if playlist_ids:
+            with ThreadPoolExecutor(max_workers=len(playlist_ids)) as executor:
+                futures = {
+                    executor.submit(convert_playlist_in_thread, sp, credentials,
+                                    pid, cache, playlist_cache): pid
+                    for pid in playlist_ids
+                }
+                for future, pid in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"❌ Error converting {pid}: {e}")
+    finally:
+        # Rows were committed as they were written; nothing to dump.
+        cache_db.close()
+        save_playlist_cache(playlist_cache)
+        if failed_tracks_file is not None:
+            failed_tracks_file.close()
 
-    save_cache(cache)
     print("\n✅ Done! If any tracks failed, check 'failed_tracks.txt'.")
@@ -0,0 +1,23 @@
+from spotify_to_youtube import normalize
+
+def test_strips_feat_annotation():
+    assert normalize('Hello (feat. Someone) Adele') == 'hello adele'
+    assert normalize('Hello (ft. Someone) Adele') == 'hello adele'
+
+def test_strips_live_and_remaster_annotations():
+    assert normalize('Song (Live) Artist') == 'song artist'
+    assert normalize('Song - 2011 Remaster Artist') == 'song artist'
+    assert normalize('Song - Remastered Version Artist') == 'song artist'
+
+def test_keeps_title_words_starting_with_noise_keywords():
+    # "with"/"live" must not match as prefixes of longer words; these
+    # parentheses are real title content, not annotations.
+    assert normalize('Song (Without You) Artist') == 'song without you artist'
+    assert normalize('Track (Liverpool Session) B') == 'track liverpool session b'
+
+def test_lowercases_and_collapses_punctuation():
+    assert normalize("Don't  Stop Me Now! Queen") == 'don t stop me now queen'
+
+def test_idempotent():
+    title = 'Hello (feat. Someone) Adele'
+    assert normalize(normalize(title)) == normalize(title)